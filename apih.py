@@ -1,41 +1,161 @@
-from fastapi import FastAPI
-import requests
-from gdacs.api import GDACSAPIReader
-from math import radians, cos, sin, sqrt, atan2
+import asyncio
+import functools
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
+import aiohttp
+from cachetools import TTLCache
+import numpy as np
+import orjson
 from datetime import datetime
 
-app = FastAPI()
-gdacs_client = GDACSAPIReader()
+session: aiohttp.ClientSession = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # One pooled session shared by every request, so upstream calls reuse connections
+    global session
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=200, limit_per_host=50, ttl_dns_cache=300),
+        timeout=aiohttp.ClientTimeout(total=5),
+    )
+    yield
+    await session.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+GDACS_URL = "https://www.gdacs.org/gdacsapi/api/events/geteventlist/EVENTS4APP"
+GDACS_TTL = 600  # seconds between GDACS feed refreshes
+GDACS_TIMEOUT = 10  # seconds; the feed is larger than the other upstream responses
+GDACS_RETRY = 60  # seconds before retrying a failed refresh
+_gdacs_cache = {"next": 0, "lats_rad": None, "lons_rad": None, "cos_lats": None, "sev": None}
+_gdacs_lock = asyncio.Lock()
+
+# Overpass scores keyed on (kind, lat, lon) rounded to ~100 m
+_overpass_cache = TTLCache(maxsize=50_000, ttl=3600)
+_overpass_inflight = {}
+# Weather results keyed on (lat, lon) rounded to ~10 km; Open-Meteo updates hourly
+_weather_cache = TTLCache(maxsize=10_000, ttl=600)
+_weather_inflight = {}
+# Caps in-flight Overpass requests (Overpass rate-limits). The semaphore is per
+# process, so the budget is split across the uvicorn workers (see __main__).
+OVERPASS_CONCURRENCY = 20
+
+
+def _worker_count():
+    """WEB_CONCURRENCY (default: one per CPU), capped so every worker gets an Overpass slot."""
+    default = os.cpu_count() or 1
+    try:
+        workers = int(os.environ.get("WEB_CONCURRENCY", default))
+    except ValueError:
+        workers = default
+    return max(1, min(workers, OVERPASS_CONCURRENCY))
+
+
+WORKERS = _worker_count()
+# Floor division, so WORKERS * slots never exceeds OVERPASS_CONCURRENCY
+_overpass_semaphore = asyncio.Semaphore(OVERPASS_CONCURRENCY // WORKERS)
+
 
 # -----------------------------
 # Utility: Distance Calculator
 # -----------------------------
-def haversine(lat1, lon1, lat2, lon2):
+def haversine_to_many(lat, lon, lats_rad, lons_rad, cos_lats):
+    """Distance in km from one point to every point in the pre-converted (radian) arrays."""
     R = 6371  # Earth radius in km
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
+    lat_rad = np.radians(lat)
+    lon_rad = np.radians(lon)
+
+    dlat = lats_rad - lat_rad
+    dlon = lons_rad - lon_rad
 
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
+    a = np.sin(dlat/2)**2 + np.cos(lat_rad) * cos_lats * np.sin(dlon/2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
     return R * c
 
 
 # -----------------------------
-# 1️⃣ Incident Density (GDACS)
+# Utility: Request Cache
 # -----------------------------
-def get_incident_density(lat, lon):
-    events = dict(gdacs_client.latest_events())["features"]
+_MISSING = object()
+
+
+async def cached_fetch(cache, inflight, key, fetch):
+    """Cached value for key, or the result of one fetch() shared by all concurrent misses."""
+    # Single get(): a TTLCache entry can expire between `in` and `[]`
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(fetch())
+        task.add_done_callback(functools.partial(_store_result, cache, inflight, key))
+        inflight[key] = task
+
+    # Shielded so one disconnecting client doesn't cancel the fetch for the others
+    return await asyncio.shield(task)
 
-    score = 0
-    for event in events:
-        ev_lat = event["geometry"]["coordinates"][1]
-        ev_lon = event["geometry"]["coordinates"][0]
 
-        distance = haversine(lat, lon, ev_lat, ev_lon)
+def _store_result(cache, inflight, key, task):
+    inflight.pop(key, None)
+    if not task.cancelled() and task.exception() is None:
+        cache[key] = task.result()
 
-        if distance < 300:  # 300 km radius
-            severity = event["properties"]["severitydata"]["severity"]
-            score += min(severity / 10, 1)
+
+# -----------------------------
+# 1️⃣ Incident Density (GDACS)
+# -----------------------------
+async def get_gdacs_arrays():
+    """Latest GDACS events as (lats_rad, lons_rad, cos_lats, severities), refreshed every GDACS_TTL."""
+    async with _gdacs_lock:
+        if time.monotonic() >= _gdacs_cache["next"]:
+            try:
+                # Same GET gdacs-api's latest_events() does, but async and with a real timeout
+                async with session.get(GDACS_URL, timeout=aiohttp.ClientTimeout(total=GDACS_TIMEOUT)) as r:
+                    r.raise_for_status()
+                    events = orjson.loads(await r.read())["features"]
+            except Exception as exc:
+                # Back off instead of every queued request retrying; keep serving the previous arrays
+                _gdacs_cache["next"] = time.monotonic() + GDACS_RETRY
+                if _gdacs_cache["sev"] is None:
+                    raise HTTPException(status_code=503, detail="GDACS feed unavailable") from exc
+            else:
+                lats, lons, sev = [], [], []
+                for e in events:
+                    try:
+                        ev_lon, ev_lat = (float(c) for c in e["geometry"]["coordinates"][:2])
+                        severity = float(e["properties"]["severitydata"]["severity"])
+                    except (KeyError, TypeError, ValueError):
+                        continue  # skip malformed features rather than failing the whole refresh
+                    lats.append(ev_lat)
+                    lons.append(ev_lon)
+                    sev.append(severity)
+
+                # Event-side trig is constant between refreshes, so do it once here
+                lats_rad = np.radians(np.asarray(lats, dtype=np.float64))
+                lons_rad = np.radians(np.asarray(lons, dtype=np.float64))
+                cos_lats = np.cos(lats_rad)
+                sev = np.asarray(sev, dtype=np.float64)
+
+                # Publish all four arrays together so readers never see a mixed refresh
+                _gdacs_cache.update(lats_rad=lats_rad, lons_rad=lons_rad, cos_lats=cos_lats, sev=sev)
+                _gdacs_cache["next"] = time.monotonic() + GDACS_TTL
+
+        if _gdacs_cache["sev"] is None:
+            raise HTTPException(status_code=503, detail="GDACS feed unavailable")
+
+        return _gdacs_cache["lats_rad"], _gdacs_cache["lons_rad"], _gdacs_cache["cos_lats"], _gdacs_cache["sev"]
+
+
+async def get_incident_density(lat, lon):
+    lats_rad, lons_rad, cos_lats, sev = await get_gdacs_arrays()
+
+    mask = haversine_to_many(lat, lon, lats_rad, lons_rad, cos_lats) < 300  # 300 km radius
+    score = float(np.minimum(sev[mask] / 10, 1).sum())
 
     return min(score, 1)
 
@@ -43,7 +163,15 @@ def get_incident_density(lat, lon):
 # -----------------------------
 # 2️⃣ Weather Severity (Open-Meteo)
 # -----------------------------
-def get_weather_severity(lat, lon):
+async def get_weather_severity(lat, lon):
+    key = (round(lat, 1), round(lon, 1))
+    return await cached_fetch(
+        _weather_cache, _weather_inflight, key,
+        functools.partial(fetch_weather_severity, lat, lon),
+    )
+
+
+async def fetch_weather_severity(lat, lon):
     url = (
         f"https://api.open-meteo.com/v1/forecast?"
         f"latitude={lat}&longitude={lon}"
@@ -52,7 +180,9 @@ def get_weather_severity(lat, lon):
         f"&timezone=auto"
     )
 
-    data = requests.get(url).json()
+    async with session.get(url) as r:
+        r.raise_for_status()
+        data = orjson.loads(await r.read())
 
     weather = data["current_weather"]
     wind = weather["windspeed"]
@@ -72,22 +202,51 @@ def get_weather_severity(lat, lon):
     return min(score, 1), data["daily"]
 
 
+# -----------------------------
+# Utility: Overpass Cache
+# -----------------------------
+def overpass_cached(kind):
+    """Memoize an Overpass lookup by rounded (lat, lon); misses are coalesced and share _overpass_semaphore."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(lat, lon):
+            key = (kind, round(lat, 3), round(lon, 3))
+
+            async def fetch():
+                async with _overpass_semaphore:
+                    return await fn(lat, lon)
+
+            return await cached_fetch(_overpass_cache, _overpass_inflight, key, fetch)
+        return wrapper
+    return decorator
+
+
+def overpass_count(data, tag):
+    """Total from an `out count;` response; runtime errors still come back as HTTP 200."""
+    if data.get("remark") or not data.get("elements"):
+        raise HTTPException(status_code=503, detail="Overpass unavailable")
+    return int(data["elements"][0]["tags"][tag])
+
+
 # -----------------------------
 # 3️⃣ Road Isolation (OSM)
 # -----------------------------
-def get_road_isolation(lat, lon):
+@overpass_cached("road")
+async def get_road_isolation(lat, lon):
     query = f"""
     [out:json];
     (
       way(around:500,{lat},{lon})["highway"];
     );
-    out body;
+    out count;
     """
 
     url = "https://overpass-api.de/api/interpreter"
-    data = requests.get(url, params={"data": query}).json()
+    async with session.get(url, params={"data": query}) as r:
+        r.raise_for_status()
+        data = orjson.loads(await r.read())
 
-    road_count = len(data["elements"])
+    road_count = overpass_count(data, "ways")
 
     return 1 - min(road_count / 50, 1)
 
@@ -95,19 +254,22 @@ def get_road_isolation(lat, lon):
 # -----------------------------
 # 4️⃣ POI Density Inverse (OSM)
 # -----------------------------
-def get_poi_inverse(lat, lon):
+@overpass_cached("poi")
+async def get_poi_inverse(lat, lon):
     query = f"""
     [out:json];
     (
       node(around:500,{lat},{lon})["amenity"];
     );
-    out body;
+    out count;
     """
 
     url = "https://overpass-api.de/api/interpreter"
-    data = requests.get(url, params={"data": query}).json()
+    async with session.get(url, params={"data": query}) as r:
+        r.raise_for_status()
+        data = orjson.loads(await r.read())
 
-    poi_count = len(data["elements"])
+    poi_count = overpass_count(data, "nodes")
 
     return 1 - min(poi_count / 30, 1)
 
@@ -128,12 +290,20 @@ def get_night_factor(daily_data):
 # MAIN RISK ENDPOINT
 # -----------------------------
 @app.get("/risk")
-def calculate_risk(lat: float, lon: float, userReports: float = 0):
+async def calculate_risk(lat: float, lon: float, userReports: float = 0):
 
-    incidentDensity = get_incident_density(lat, lon)
-    weatherSeverity, daily_data = get_weather_severity(lat, lon)
-    roadIsolation = get_road_isolation(lat, lon)
-    poiDensityInverse = get_poi_inverse(lat, lon)
+    # Independent upstream calls, run concurrently
+    (
+        incidentDensity,
+        (weatherSeverity, daily_data),
+        roadIsolation,
+        poiDensityInverse,
+    ) = await asyncio.gather(
+        get_incident_density(lat, lon),
+        get_weather_severity(lat, lon),
+        get_road_isolation(lat, lon),
+        get_poi_inverse(lat, lon),
+    )
     nightFactor = get_night_factor(daily_data)
 
     risk = (
@@ -154,4 +324,20 @@ def calculate_risk(lat: float, lon: float, userReports: float = 0):
         "nightFactor": nightFactor,
         "userReports": userReports,
         "finalRiskScore": round(risk, 3)
-    }
\ No newline at end of file
+    }
+
+
+# Worker count comes from WEB_CONCURRENCY (default: one per CPU, at most
+# OVERPASS_CONCURRENCY) and the per-worker Overpass budget is derived from it.
+# Set WEB_CONCURRENCY rather than passing --workers to the uvicorn CLI, or each
+# worker will size its Overpass semaphore for a different worker count.
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "apih:app",
+        host=os.environ.get("HOST", "127.0.0.1"),
+        loop="uvloop",
+        http="httptools",
+        workers=WORKERS,
+    )